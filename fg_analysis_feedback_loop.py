@@ -1,480 +1,1200 @@
-from typing import Annotated, Optional, Any
-from enum import Enum
-from pydantic import BaseModel, Field
-from autogen import (
-    ConversableAgent,
-    UserProxyAgent,
-    register_hand_off,
-    OnContextCondition,
-    AfterWork,
-    AfterWorkOption,
-    initiate_swarm_chat,
-    ContextExpression,
-    SwarmResult,
-)
-
-import os
-
-from utils import get_openai_api_key
-OPENAI_API_KEY = get_openai_api_key()
-llm_config = {
-    "api_type": "openai", 
-    "model": "gpt-4o-mini",
-    "parallel_tool_calls": False,
-    "cache_seed": None
-}
-
-# Feedback Loop pattern for iterative analysis refinement
-
-
-# Document stage tracking for the feedback loop
-class DocumentStage(str, Enum):
-    ANALYSIS = "analysis"
-    REVIEW = "review"
-    REVISION = "revision"
-    FINAL = "final" 
-
-# Shared context for tracking document state
-shared_context = {
-    # Feedback loop state
-    "loop_started": False,
-    "current_iteration": 0,
-    "max_iterations": 3,
-    "iteration_needed": True,
-    "current_stage": DocumentStage.ANALYSIS,
-
-    # Document data at various stages
-    "focus_group_transcripts": "",
-    "focus_group_objectives": "",
-    "analysis_draft": {},
-    "feedback_collection": {},
-    "revised_analysis": {},
-    "final_report": {},
-
-    # Error state
-    "has_error": False,
-    "error_message": "",
-    "error_stage": ""
-}
-
-#  Read Transcripts and Objectives
-def read_data(context_variables: dict) -> SwarmResult:
-    """Read the transcripts and objectives files and start the analysis feedback loop"""
-    # Read transcripts
-    with open('data/transcripts.md', 'r') as file:
-        transcripts = file.read()
-    context_variables['fg_transcripts'] = transcripts
-    
-    # Read objectives
-    with open('data/objectives.md', 'r') as file:
-        objectives = file.read()
-    context_variables['fg_objectives'] = objectives
-
-    context_variables["loop_started"] = True # Drives OnContextCondition to the next agent
-    context_variables["current_stage"] = DocumentStage.ANALYSIS.value # Drives OnContextCondition to the next agent
-    context_variables["current_iteration"] = 1
- 
-    return SwarmResult(
-        context_variables=context_variables,
-        values=f"Read transcripts and objectives, and started the analysis feedback loop.",
-    )
-
-
-
-# Analysis Drafting Stage
-class AnalysisDraft(BaseModel):
-    title: str = Field(..., description="Analysis title")
-    content: str = Field(..., description="Full text content of the analysis")
-
-def submit_analysis_draft(
-    title: Annotated[str, "Analysis title"],
-    content: Annotated[str, "Full text content of the analysis"],
-    context_variables: dict[str, Any]
-) -> SwarmResult:
-    """
-    Submit the analysis draft for review
-    """
-    analysis_draft = AnalysisDraft(
-        title=title,
-        content=content
-    )
-    context_variables["analysis_draft"] = analysis_draft.model_dump()
-    context_variables["current_stage"] = DocumentStage.REVIEW.value # Drives OnContextCondition to the next agent
-
-    return SwarmResult(
-        values="Analysis draft submitted. Moving to review stage.",
-        context_variables=context_variables,
-    )
-
-
-
-# Analysis Feedback Stage
-class FeedbackItem(BaseModel):
-    feedback: str = Field(..., description="Detailed feedback")
-    severity: str = Field(..., description="Severity level of the feedback: minor, moderate, major, critical")
-    recommendation: Optional[str] = Field(..., description="Recommended action to address the feedback")
-
-class FeedbackCollection(BaseModel):
-    items: list[FeedbackItem] = Field(..., description="Collection of feedback items")
-    overall_assessment: str = Field(..., description="Overall assessment of the analysis")
-    priority_issues: list[str] = Field(..., description="List of priority issues to address")
-    iteration_needed: bool = Field(..., description="Whether another iteration is needed")
-
-def submit_feedback(
-    items: Annotated[list[FeedbackItem], "Collection of feedback items"],
-    overall_assessment: Annotated[str, "Overall assessment of the analysis"],
-    priority_issues: Annotated[list[str], "List of priority issues to address"],
-    iteration_needed: Annotated[bool, "Whether another iteration is needed"],
-    context_variables: dict[str, Any]
-) -> SwarmResult:
-    """
-    Submit feedback on the document
-    """
-    feedback = FeedbackCollection(
-        items=items,
-        overall_assessment=overall_assessment,
-        priority_issues=priority_issues,
-        iteration_needed=iteration_needed
-    )
-    context_variables["feedback_collection"] = feedback.model_dump()
-    context_variables["iteration_needed"] = feedback.iteration_needed
-    context_variables["current_stage"] = DocumentStage.REVISION.value # Drives OnContextCondition to the next agent
-
-    return SwarmResult(
-        values="Feedback submitted. Moving to revision stage.",
-        context_variables=context_variables,
-    )
-
-# Analysis Revision Stage
-class RevisedAnalysis(BaseModel):
-    title: str = Field(..., description="Analysis title")
-    content: str = Field(..., description="Full text content after revision")
-    changes_made: Optional[list[str]] = Field(..., description="List of changes made based on feedback")
-
-def submit_revised_analysis(
-    title: Annotated[str, "Analysis title"],
-    content: Annotated[str, "Full text content after revision"],
-    changes_made: Annotated[Optional[list[str]], "List of changes made based on feedback"],
-    context_variables: dict[str, Any]
-) -> SwarmResult:
-    """
-    Submit the revised document, which may lead to another feedback loop or finalization
-    """
-    revised = RevisedAnalysis(
-        title=title,
-        content=content,
-        changes_made=changes_made
-    )
-    context_variables["revised_analysis"] = revised.model_dump()
-
-    # Check if we need another iteration or if we're done
-    if context_variables["iteration_needed"] and context_variables["current_iteration"] < context_variables["max_iterations"]:
-        context_variables["current_iteration"] += 1
-        context_variables["current_stage"] = DocumentStage.REVIEW.value
-
-        # Update the analysis draft with the revisions for the next review
-        context_variables["analysis_draft"] = {
-            "title": revised.title,
-            "content": revised.content
-        } 
-
-        return SwarmResult(
-            values=f"Analysis revised. Starting iteration {context_variables['current_iteration']} with another review.",
-            context_variables=context_variables,
-        )
-    else:
-        # We're done with revisions, move to final stage
-        context_variables["current_stage"] = DocumentStage.FINAL.value # Drives OnContextCondition to the next agent
-
-        return SwarmResult(
-            values="Revisions complete. Moving to document finalization.",
-            context_variables=context_variables,
-        )
-
-    
-# Analysis Finalization Stage
-class FinalAnalysis(BaseModel):
-    title: str = Field(..., description="Final analysis title")
-    content: str = Field(..., description="Full text content of the final analysis")
-
-def finalize_analysis(
-    title: Annotated[str, "Final analysis title"],
-    content: Annotated[str, "Full text content of the final analysis"],
-    context_variables: dict[str, Any]
-) -> SwarmResult:
-    """
-    Submit the final analysis and complete the feedback loop
-    """
-    final = FinalAnalysis(
-        title=title,
-        content=content
-    )
-    context_variables["final_analysis"] = final.model_dump()
-    context_variables["iteration_needed"] = False
-
-    return SwarmResult(
-        values="Analysis finalized. Feedback loop complete.",
-        agent=report_recorder_agent,
-        context_variables=context_variables,
-    )
-
-# Write Report to File Stage
-def write_report_to_file(report: str, filename: str) -> SwarmResult:
-    """Write the final report to a markdown file in the 'reports' directory."""
-    # Create the 'reports' directory if it doesn't exist
-    reports_dir = os.path.join(os.getcwd(), "reports")
-    if not os.path.exists(reports_dir):
-        os.makedirs(reports_dir)
-    
-    filepath = os.path.join(reports_dir, filename)
-    with open(filepath, 'w') as f:
-        f.write(report)
-    
-    return SwarmResult(
-        values=f"Report written to {filepath}",
-        context_variables={}
-    )
-
-# Agents for the feedback loop
-ingestion_agent = ConversableAgent(
-    name="ingestion_agent",
-    llm_config=llm_config,
-    system_message="You are a helpful assistant that reads the transcripts and objectives files.",
-    functions=[read_data]
-)
-
-drafting_agent = ConversableAgent(
-    name="drafting_agent",
-    system_message="""You are the analysis drafting agent responsible for creating the initial draft.
-
-    Your task is to analyze the focus group transcripts and create a first draft of the analysis. 
-    Review the content in the context of the focus group objectives. 
-
-    Identify key themes, patterns, and insights. Pay particular attention to how the discussion points relate 
-    to the focus group objectives.
-
-    expected_output:
-    A comprehensive analysis draft that includes:
-    1. Identified key themes and patterns from the focus group transcripts
-    2. Insights derived from the discussion, especially those relating to the focus group objectives
-    3. Notable trends or unexpected findings
-    4. Areas of consensus or disagreement among participants
-    5. Potential implications of the findings
-    6. Any gaps in the information or areas that may require further investigation
-    7. Initial recommendations based on the analysis
-
-    You must call the submit_analysis_draft tool with your draft and that will move on to the review stage.""",
-    llm_config=llm_config,
-    functions=[submit_analysis_draft]
-)
-
-review_agent = ConversableAgent(
-    name="review_agent",
-    system_message="""You are the analysis review agent responsible for critical evaluation.
-
-    Your task is to carefully review the current analysis draft and provide constructive feedback.
-    Compare the analysis to the focus group objectives to ensure alignment and thoroughness. Assess the quality, clarity, and depth of 
-    insights provided. Identify any gaps, inconsistencies, or areas where the analysis could be improved.
-    
-    For the feedback you MUST provide the following:
-    1. items: list of feedback items (seen next section for the collection of feedback items)
-    2. overall_assessment: Overall assessment of the analysis
-    3. priority_issues: List of priority issues to address
-    4. iteration_needed: Whether another iteration is needed (True or False)
-
-    For each item within feedback, you MUST provide the following:
-    1. feedback: Detailed feedback explaining the issue
-    2. severity: Rate as 'minor', 'moderate', 'major', or 'critical'
-    3. recommendation: A clear, specific action to address the feedback
-
-    Provide specific feedback with examples and clear recommendations for improvement.
-    For each feedback item, rate its severity.
-
-    If this is a subsequent review iteration, also evaluate how well previous feedback was addressed.
-
-    Use the submit_feedback tool when your review is complete, indicating whether another iteration is needed.
-    """,
-    llm_config=llm_config,
-    functions=[submit_feedback]
-)
-
-revision_agent = ConversableAgent(
-    name="revision_agent",
-    system_message="""You are the analysis revision agent responsible for implementing feedback.
-
-    Your task is to revise the analysis based on the feedback provided:
-    - Address each feedback item in priority order
-    - Make specific improvements to the content, structure, and clarity
-    - Ensure the revised analysis still aligns with the original objectives
-    - Track and document the changes you make
-
-    Focus on substantive improvements that address the feedback while preserving the analysis' strengths.
-
-    Use the submit_revised_analysis tool when your revisions are complete. The analysis may go through
-    multiple revision cycles depending on the feedback.""",
-    llm_config=llm_config,
-    functions=[submit_revised_analysis]
-)
-
-finalization_agent = ConversableAgent(
-    name="finalization_agent",
-    system_message="""You are the finalization agent responsible for completing the process.
-
-    Your task is to put the finishing touches on the analysis:
-    - Review the analysis's revision history
-    - Make any final minor adjustments for clarity and polish
-    - Ensure the analysis fully satisfies the original objectives
-    - Prepare the final report for delivery with proper formatting
-
-    Create a summary of the analysis's revision journey highlighting how it evolved through the process.
-
-    Use the finalize_analysis tool when the analysis is complete and ready for delivery.""",
-    llm_config=llm_config,
-    functions=[finalize_analysis]
-)
-
-report_recorder_agent = ConversableAgent(
-    name="report_recorder_agent",
-    system_message="""You are the report recorder agent responsible for recording the final report.
-
-    Your task is to convert the final report into markdown format and save it in the 'reports' directory.
-
-    Use the write_report_to_file tool to save the final report in the 'reports' directory.""",
-    llm_config=llm_config,
-    functions=[write_report_to_file]
-)
-
-# User agent for interaction
-user = UserProxyAgent(
-    name="user",
-    code_execution_config=False
-)
-
-# Register handoffs for the feedback loop
-# Ingestion agent starts the loop
-register_hand_off(
-    agent=ingestion_agent,
-    hand_to=[
-        OnContextCondition(
-            target=drafting_agent,
-            condition=ContextExpression("${loop_started} == True and ${current_stage} == 'analysis'")
-        )
-    ]
-)
-
-# Drafting agent passes to Review agent
-register_hand_off(
-    agent=drafting_agent,
-    hand_to=[
-        OnContextCondition(
-            target=review_agent,
-            condition=ContextExpression("${current_stage} == 'review'")
-        )
-    ]
-)
-
-# Review agent passes to Revision agent
-register_hand_off(
-    agent=review_agent,
-    hand_to=[
-        OnContextCondition(
-            target=revision_agent,
-            condition=ContextExpression("${current_stage} == 'revision'")
-        )
-    ]
-)
-
-# Revision agent passes back to Review agent or to Finalization agent
-register_hand_off(
-    agent=revision_agent,
-    hand_to=[
-        OnContextCondition(
-            target=finalization_agent,
-            condition=ContextExpression("${current_stage} == 'final'")
-        ),
-        OnContextCondition(
-            target=review_agent,
-            condition=ContextExpression("${current_stage} == 'review'")
-        )
-    ]
-)
-
-# Finalization agent passes to Report recorder agent
-register_hand_off(
-    agent=finalization_agent,
-    hand_to=[
-        AfterWork(report_recorder_agent), 
-    ] 
-)
-
-# Report recorder agent completes the loop and returns to user
-register_hand_off(
-    agent=report_recorder_agent,
-    hand_to=[
-        AfterWork(AfterWorkOption.REVERT_TO_USER)
-    ]
-)
-
-
-# Run the feedback loop
-def run_feedback_loop_pattern():
-    """Run the feedback loop pattern for analysis creation with iterative refinement"""
-    print("Initiating Feedback Loop Pattern for Analysis Creation...")
-
-    chat_result, final_context, last_agent = initiate_swarm_chat(
-        initial_agent=ingestion_agent,
-        agents=[
-            ingestion_agent,
-            drafting_agent,
-            review_agent,
-            revision_agent,
-            finalization_agent,
-            report_recorder_agent
-        ],
-        messages=f"Please read the focus group transcripts and focus group objectives", 
-        context_variables=shared_context,
-        user_agent=user,
-        max_rounds=30,
-        after_work=AfterWork(AfterWorkOption.REVERT_TO_USER)
-    )
-
-    if final_context.get("final_analysis"):
-        print("Analysis completed successfully!")
-        print("\n===== ANALYSIS SUMMARY =====\n")
-        print(f"Title: {final_context['final_analysis'].get('title')}")
-        print(f"Word Count: {final_context['final_analysis'].get('word_count')}")
-        print(f"Iterations: {final_context.get('current_iteration')}")
-
-        print("\n===== FEEDBACK LOOP PROGRESSION =====\n")
-        # Show the progression through iterations
-        for i in range(1, final_context.get('current_iteration') + 1):
-            if i == 1:
-                print(f"Iteration {i}:")
-                print(f"  Analysis: {'✅ Completed' if 'final_analysis' in final_context else '❌ Not reached'}")
-                print(f"  Review: {'✅ Completed' if 'feedback_collection' in final_context else '❌ Not reached'}")
-                print(f"  Revision: {'✅ Completed' if 'revised_analysis' in final_context else '❌ Not reached'}")
-            else:
-                print(f"Iteration {i}:")
-                print(f"  Review: {'✅ Completed' if 'feedback_collection' in final_context else '❌ Not reached'}")
-                print(f"  Revision: {'✅ Completed' if 'revised_analysis' in final_context else '❌ Not reached'}")
-
-        print(f"Finalization: {'✅ Completed' if 'final_analysis' in final_context else '❌ Not reached'}")
-
-        print("\n===== REVISION HISTORY =====\n")
-        for history_item in final_context['final_analysis'].get('revision_history', []):
-            print(f"- {history_item}")
-
-        print("\n===== FINAL ANALYSIS =====\n")
-        print(final_context['final_analysis'].get('content', ''))
-
-        print("\n\n===== SPEAKER ORDER =====\n")
-        for message in chat_result.chat_history:
-            if "name" in message and message["name"] != "_Swarm_Tool_Executor":
-                print(f"{message['name']}")
-    else:
-        print("Document creation did not complete successfully.")
-        if final_context.get("has_error"):
-            print(f"Error during {final_context.get('error_stage')} stage: {final_context.get('error_message')}")
-
-if __name__ == "__main__":
+from typing import Annotated, Optional, Any
+from enum import IntEnum
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pydantic import BaseModel, ConfigDict, Field
+from autogen import (
+    ConversableAgent,
+    UserProxyAgent,
+    register_hand_off,
+    OnContextCondition,
+    AfterWork,
+    AfterWorkOption,
+    initiate_swarm_chat,
+    ContextExpression,
+    SwarmResult,
+)
+
+import contextlib
+import functools
+import hashlib
+import json
+import mmap
+import os
+import shelve
+import sys
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from utils import get_openai_api_key
+OPENAI_API_KEY = get_openai_api_key()
+
+# Route LLM calls through OpenAI's Batch endpoint (~50% cheaper, async with a
+# 24h completion window). Only worth enabling for non-interactive runs where
+# latency doesn't matter; defaults to the regular synchronous API.
+USE_BATCH_API = os.getenv("FG_USE_BATCH_API", "").lower() in ("1", "true", "yes")
+
+if USE_BATCH_API:
+    llm_config = {
+        "config_list": [{"model_client_cls": "BatchOpenAIClient", "model": "gpt-4o-mini"}],
+        "cache_seed": None
+    }
+else:
+    llm_config = {
+        "api_type": "openai",
+        "model": "gpt-4o-mini",
+        "parallel_tool_calls": False,
+        "cache_seed": None,
+        # Shared cache key so every agent's requests hash to the same prompt-cache
+        # prefix on OpenAI's side (cached input tokens are cheaper and faster)
+        "extra_headers": {"prompt-cache-key": "fg-loop-v1"}
+    }
+
+# JSON entry points for this module: orjson's Rust (de)serializer when it is
+# installed, stdlib json otherwise. Everything in this file that turns objects
+# into JSON text (and back) goes through these two helpers.
+def _json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj)
+
+def _json_loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+# On-disk reply cache for development replays. When enabled, an agent asked for
+# a reply to an identical (system message, last message, model) triple serves
+# the previous answer from disk instead of spending an LLM round-trip — re-runs
+# over unchanged transcripts short-circuit entirely. Keyed by a BLAKE2b hash;
+# the model name in the key invalidates the cache on model changes.
+ENABLE_REPLY_CACHE = os.getenv("FG_REPLY_CACHE", "").lower() in ("1", "true", "yes")
+_REPLY_CACHE_DIR = os.path.join(".cache", "feedback_loop")
+# dbm backends don't support concurrent writers, and the cache is attached to
+# fan-out workers that run in threads — all shelf access goes through this lock
+_REPLY_CACHE_LOCK = threading.Lock()
+
+def _reply_cache_key(agent: ConversableAgent, messages: Optional[list]) -> str:
+    # Hash the full message history, not just the last message: for swarm agents
+    # the last message is the tool executor's constant status string, while the
+    # actual draft/feedback live earlier in the history as tool-call arguments
+    history = _json_dumps(messages) if messages else ""
+    model = llm_config.get("model") or llm_config.get("config_list", [{}])[0].get("model", "")
+    raw = f"{agent.system_message}\x00{history}\x00{model}"
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+def enable_reply_cache(agent: ConversableAgent) -> None:
+    """Wrap an agent's generate_reply so identical prompts are served from disk"""
+    original_generate_reply = agent.generate_reply
+
+    @functools.wraps(original_generate_reply)
+    def cached_generate_reply(messages=None, sender=None, **kwargs):
+        key = _reply_cache_key(agent, messages)
+        os.makedirs(_REPLY_CACHE_DIR, exist_ok=True)
+        shelf_path = os.path.join(_REPLY_CACHE_DIR, "replies")
+
+        with _REPLY_CACHE_LOCK:
+            with shelve.open(shelf_path) as cache:
+                if key in cache:
+                    return cache[key]
+
+        # The LLM round-trip happens outside the lock so parallel workers still
+        # overlap; only the shelf open/read/write is serialized
+        reply = original_generate_reply(messages=messages, sender=sender, **kwargs)
+        if isinstance(reply, (str, dict)):  # Don't cache None/unfinished replies
+            with _REPLY_CACHE_LOCK:
+                with shelve.open(shelf_path) as cache:
+                    cache[key] = reply
+        return reply
+
+    agent.generate_reply = cached_generate_reply
+
+
+# Custom model client that serializes each request into OpenAI's Batch JSONL
+# format, uploads it, and polls the batch until the result is ready. Registered
+# on the agents only when USE_BATCH_API is set.
+class BatchOpenAIClient:
+    """Chat-completion client backed by OpenAI's Batch endpoint"""
+
+    POLL_INTERVAL_SECONDS = 30
+
+    def __init__(self, config: dict, **kwargs):
+        from openai import OpenAI
+        self._client = OpenAI(api_key=OPENAI_API_KEY)
+        self._model = config.get("model", "gpt-4o-mini")
+
+    def create(self, params: dict):
+        import io
+        import time
+        from openai.types.chat import ChatCompletion
+
+        body = {"model": self._model, "messages": params["messages"]}
+        for key in ("tools", "tool_choice", "temperature", "parallel_tool_calls"):
+            if key in params:
+                body[key] = params[key]
+
+        line = _json_dumps({
+            "custom_id": "request-1",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        })
+        batch_file = self._client.files.create(
+            file=io.BytesIO(line.encode('utf-8')), purpose="batch"
+        )
+        batch = self._client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.POLL_INTERVAL_SECONDS)
+            batch = self._client.batches.retrieve(batch.id)
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+        output = self._client.files.content(batch.output_file_id).text
+        result = _json_loads(output.splitlines()[0])
+        return ChatCompletion.model_validate(result["response"]["body"])
+
+    def message_retrieval(self, response):
+        return [choice.message for choice in response.choices]
+
+    def cost(self, response) -> float:
+        return 0.0  # Batch pricing isn't exposed in the response; tracked on the dashboard
+
+    @staticmethod
+    def get_usage(response) -> dict:
+        usage = response.usage
+        return {
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "total_tokens": usage.total_tokens if usage else 0,
+            "cost": 0.0,
+            "model": response.model,
+        }
+
+
+# Feedback Loop pattern for iterative analysis refinement
+
+# Shared config for the document models: frozen skips __init__ bookkeeping for
+# mutation support and makes instances hashable, extra='forbid' lets pydantic
+# use its fast-path validator. These objects are created and copied on every
+# handoff, so cheap construction matters.
+_MODEL_CONFIG = ConfigDict(frozen=True, extra='forbid')
+
+
+# Document stage tracking for the feedback loop. An IntEnum so the routing
+# conditions compare a single integer instead of walking string bytes on every
+# handoff decision.
+class DocumentStage(IntEnum):
+    ANALYSIS = 0
+    REVIEW = 1
+    REVISION = 2
+    FINAL = 3
+
+# Shared context for tracking document state
+shared_context = {
+    # Feedback loop state
+    "loop_started": False,
+    "current_iteration": 0,
+    "max_iterations": 3,
+    "iteration_needed": True,
+    "current_stage": DocumentStage.ANALYSIS,
+    "max_parallel_reviewers": 2,
+    "compress_transcripts": False,
+    # When True, iteration 1 uses the combined draft+review agent (one LLM call);
+    # set False to route to the drafting agent, which can also fan sections out
+    # in parallel via submit_draft_outline
+    "use_combined_draft_review": True,
+
+    # Cheap stage-completion markers that survive the eviction of the bulky
+    # intermediates, so the post-run report can still show the progression
+    "review_completed": False,
+    "revision_completed": False,
+
+    # Document data at various stages
+    "focus_group_transcripts": "",
+    "focus_group_objectives": "",
+    "analysis_draft": {},
+    "feedback_collection": {},
+    "revised_analysis": {},
+    "final_report": {},
+
+    # Error state
+    "has_error": False,
+    "error_message": "",
+    "error_stage": ""
+}
+
+#  Read Transcripts and Objectives
+# Module-level store for the large documents. context_variables is deep-copied
+# by autogen on every handoff, so agents pass around short keys into this store
+# instead of the full text blobs.
+_DOC_STORE: dict[str, str] = {}
+
+@functools.lru_cache(maxsize=4)
+def _load_document(path: str) -> str:
+    """Read a data file once per process; repeat runs reuse the cached text
+
+    Uses a read-only mmap so the kernel page cache backs the read directly,
+    avoiding the extra kernel->userspace copy that file.read() would make on
+    large transcript files.
+    """
+    with open(path, 'rb') as file:
+        with contextlib.closing(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+            if hasattr(mm, 'madvise'):  # Not available on all platforms
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            return mm[:].decode('utf-8')
+
+def get_document(key: str) -> str:
+    """Fetch a document from the module-level store by its context key"""
+    return _DOC_STORE.get(key, "")
+
+# Upload the transcripts to OpenAI's Files API once and pass the short file_id
+# around instead of re-sending the full text O(iterations x reviewers) times.
+# Only assistants-style endpoints can consume file attachments, so this is
+# opt-in; the chat-completions agents keep the inline-text fallback.
+UPLOAD_TRANSCRIPTS = os.getenv("FG_UPLOAD_TRANSCRIPTS", "").lower() in ("1", "true", "yes")
+
+@functools.lru_cache(maxsize=1)
+def _upload_transcripts_file() -> str:
+    """Upload the transcripts file once per process and return its file_id"""
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    with open('data/transcripts.md', 'rb') as file:
+        return client.files.create(file=file, purpose='assistants').id
+
+@functools.lru_cache(maxsize=1)
+def _compress_transcripts(transcripts: str) -> str:
+    """Compress the transcripts prompt with LLMLingua, keeping structural tokens
+
+    The transcripts dominate the prompt-token cost and are re-sent every
+    review/revision cycle, so trimming filler roughly halves LLM latency and
+    cost per call. Returns the text unchanged if llmlingua isn't installed.
+    """
+    try:
+        from llmlingua import PromptCompressor
+    except ImportError:
+        return transcripts
+
+    compressor = PromptCompressor()
+    result = compressor.compress_prompt(transcripts, rate=0.5, force_tokens=['\n', ':'])
+    return result['compressed_prompt']
+
+def read_data(context_variables: dict) -> SwarmResult:
+    """Read the transcripts and objectives files and start the analysis feedback loop"""
+    # Read transcripts and objectives (memoized across swarm invocations)
+    transcripts = _load_document('data/transcripts.md')
+    objectives = _load_document('data/objectives.md')
+
+    # Optionally compress the transcripts once at ingestion; the original text
+    # is kept in the store for final-report citation
+    if context_variables.get("compress_transcripts"):
+        _DOC_STORE['transcripts_original'] = transcripts
+        transcripts = _compress_transcripts(transcripts)
+
+    # Store the blobs once at module level and only their keys in the context,
+    # so per-handoff deep copies of context_variables stay small
+    _DOC_STORE['transcripts'] = transcripts
+    _DOC_STORE['objectives'] = objectives
+    context_variables['fg_transcripts_key'] = 'transcripts'
+    context_variables['fg_objectives_key'] = 'objectives'
+
+    # Optionally register the transcripts with the Files API so downstream
+    # integrations can attach the file_id instead of inlining the text
+    if UPLOAD_TRANSCRIPTS:
+        context_variables['transcripts_file_id'] = _upload_transcripts_file()
+
+    # Append the transcripts and objectives to each agent's system message as a
+    # fixed suffix. The instructions + transcripts then form a long, byte-stable
+    # prompt prefix across every iteration, so OpenAI's automatic prompt cache
+    # (>=1024-token prefix) hits on each review/revision round-trip. Only the
+    # small dynamic parts (current draft, current feedback) vary per turn.
+    _append_shared_context_to_agents(transcripts, objectives)
+
+    context_variables["loop_started"] = True # Drives OnContextCondition to the next agent
+    context_variables["current_stage"] = DocumentStage.ANALYSIS.value # Drives OnContextCondition to the next agent
+    context_variables["current_iteration"] = 1
+ 
+    return SwarmResult(
+        context_variables=context_variables,
+        values=f"Read transcripts and objectives, and started the analysis feedback loop.",
+    )
+
+
+
+# Analysis Drafting Stage
+class AnalysisDraft(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    title: str = Field(..., description="Analysis title")
+    content: str = Field(..., description="Full text content of the analysis")
+
+def submit_analysis_draft(
+    title: Annotated[str, "Analysis title"],
+    content: Annotated[str, "Full text content of the analysis"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit the analysis draft for review
+    """
+    analysis_draft = AnalysisDraft(
+        title=title,
+        content=content
+    )
+    # Store the model instance itself; dumping to a dict here would only be
+    # re-parsed downstream, and the instance survives autogen's context copies
+    context_variables["analysis_draft"] = analysis_draft
+    context_variables["current_stage"] = DocumentStage.REVIEW.value # Drives OnContextCondition to the next agent
+
+    return SwarmResult(
+        values="Analysis draft submitted. Moving to review stage.",
+        context_variables=context_variables,
+    )
+
+
+
+# Skeleton-of-Thought Drafting
+# Instead of generating the whole analysis in one monolithic completion, the
+# drafting agent may submit just the section outline; each section is then
+# expanded by its own terse worker agent in parallel, so wall time is the
+# slowest section rather than the sum of all sections.
+def _expand_section(section: str, transcripts: str, objectives: str) -> str:
+    """Expand one outline section into full analysis text"""
+    writer = _finish_worker_setup(ConversableAgent(
+        name=f"section_writer_{_slugify(section)[:40]}",
+        system_message=f"""You write one section of a focus group analysis. Write the full text
+    for the section you are given, grounded in the transcripts and objectives below. Respond
+    with the section text only — no preamble, no headers.
+
+    ===== FOCUS GROUP OBJECTIVES =====
+    {objectives}
+
+    ===== FOCUS GROUP TRANSCRIPTS =====
+    {transcripts}""",
+        llm_config=llm_config,
+    ))
+    reply = writer.generate_reply(
+        messages=[{"role": "user", "content": f"Write the section: {section}"}]
+    )
+    content = reply.get("content") if isinstance(reply, dict) else reply
+    return content or ""
+
+def submit_draft_outline(
+    title: Annotated[str, "Analysis title"],
+    sections: Annotated[list[str], "Ordered list of section titles for the analysis"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit a section outline; the sections are expanded in parallel into the full draft
+    """
+    transcripts = get_document(context_variables.get("fg_transcripts_key", ""))
+    objectives = get_document(context_variables.get("fg_objectives_key", ""))
+
+    with ThreadPoolExecutor(max_workers=len(sections) or 1) as executor:
+        expansions = list(executor.map(
+            lambda section: _expand_section(section, transcripts, objectives), sections
+        ))
+
+    content = "\n\n".join(
+        f"## {section}\n\n{text}" for section, text in zip(sections, expansions)
+    )
+    analysis_draft = AnalysisDraft(title=title, content=content)
+    context_variables["analysis_draft"] = analysis_draft
+    context_variables["current_stage"] = DocumentStage.REVIEW.value # Drives OnContextCondition to the next agent
+
+    return SwarmResult(
+        values=f"Draft assembled from {len(sections)} parallel section expansions. Moving to review stage.",
+        context_variables=context_variables,
+    )
+
+
+# Analysis Feedback Stage
+class FeedbackItem(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    feedback: str = Field(..., description="Detailed feedback")
+    severity: str = Field(..., description="Severity level of the feedback: minor, moderate, major, critical")
+    recommendation: Optional[str] = Field(..., description="Recommended action to address the feedback")
+
+class FeedbackCollection(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    items: list[FeedbackItem] = Field(..., description="Collection of feedback items")
+    overall_assessment: str = Field(..., description="Overall assessment of the analysis")
+    priority_issues: list[str] = Field(..., description="List of priority issues to address")
+    iteration_needed: bool = Field(..., description="Whether another iteration is needed")
+
+def _needs_revision(feedback: FeedbackCollection) -> bool:
+    """A draft only goes to revision if another iteration was requested or serious issues were flagged"""
+    return feedback.iteration_needed or any(
+        item.severity in ('critical', 'major') for item in feedback.items
+    )
+
+def _apply_review_outcome(context_variables: dict[str, Any], feedback: FeedbackCollection) -> str:
+    """Record the review and route to revision, or straight to finalization when approved
+
+    Skipping the revision stage on approval saves a full LLM round-trip per fast path.
+    """
+    context_variables["feedback_collection"] = feedback
+    context_variables["iteration_needed"] = feedback.iteration_needed
+    context_variables["review_completed"] = True
+
+    if _needs_revision(feedback):
+        context_variables["current_stage"] = DocumentStage.REVISION.value # Drives OnContextCondition to the next agent
+        return "Moving to revision stage."
+
+    # Approved as-is: the draft becomes the revised analysis so finalization has input
+    draft = context_variables.get("analysis_draft")
+    if isinstance(draft, dict):
+        draft = AnalysisDraft(**draft)
+    if draft is not None:
+        context_variables["revised_analysis"] = RevisedAnalysis(
+            title=draft.title, content=draft.content, changes_made=[]
+        )
+        context_variables["revision_completed"] = True
+    context_variables.pop("analysis_draft", None)
+    context_variables["current_stage"] = DocumentStage.FINAL.value # Drives OnContextCondition to the next agent
+    return "No revision needed. Moving straight to finalization."
+
+def submit_feedback(
+    items: Annotated[list[FeedbackItem], "Collection of feedback items"],
+    overall_assessment: Annotated[str, "Overall assessment of the analysis"],
+    priority_issues: Annotated[list[str], "List of priority issues to address"],
+    iteration_needed: Annotated[bool, "Whether another iteration is needed"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit feedback on the document
+    """
+    feedback = FeedbackCollection(
+        items=items,
+        overall_assessment=overall_assessment,
+        priority_issues=priority_issues,
+        iteration_needed=iteration_needed
+    )
+    outcome = _apply_review_outcome(context_variables, feedback)
+
+    return SwarmResult(
+        values=f"Feedback submitted. {outcome}",
+        context_variables=context_variables,
+    )
+
+# Combined Draft + Review Stage (first iteration only)
+class DraftPlusReview(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    draft: AnalysisDraft = Field(..., description="The initial analysis draft")
+    feedback: FeedbackCollection = Field(..., description="Critique of the draft")
+
+def submit_draft_and_review(
+    draft: Annotated[AnalysisDraft, "The initial analysis draft"],
+    feedback: Annotated[FeedbackCollection, "Critique of the draft"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit the initial draft together with its review in a single step
+    """
+    combined = DraftPlusReview(draft=draft, feedback=feedback)
+    context_variables["analysis_draft"] = combined.draft
+    outcome = _apply_review_outcome(context_variables, combined.feedback)
+
+    return SwarmResult(
+        values=f"Draft and review submitted together. {outcome}",
+        context_variables=context_variables,
+    )
+
+# Parallel Review Stage
+# Stances used to seed the parallel reviewer variants. The first reviewer is a
+# straight critic; the second plays devil's advocate to surface weaknesses the
+# first may agree with too readily.
+_REVIEWER_STANCES = [
+    ("balanced_reviewer", 0.2, "Evaluate the analysis fairly and constructively."),
+    ("devils_advocate_reviewer", 0.9, """Play devil's advocate: actively look for weak arguments,
+    unsupported claims, and alternative interpretations of the transcript evidence that the
+    analysis ignores. Be skeptical of the analysis' conclusions."""),
+]
+
+def _make_reviewer_variant(name: str, temperature: float, stance: str,
+                           transcripts: str, objectives: str) -> ConversableAgent:
+    """Create one reviewer variant for the parallel review fan-out"""
+    return ConversableAgent(
+        name=name,
+        system_message=f"""You are an analysis review agent responsible for critical evaluation.
+
+    {stance}
+
+    Review the analysis draft against the focus group objectives. Respond ONLY with a JSON
+    object (no markdown fences, no commentary) with exactly these fields:
+    - items: list of objects with fields feedback (string), severity ('minor', 'moderate',
+      'major', or 'critical'), and recommendation (string)
+    - overall_assessment: string
+    - priority_issues: list of strings
+    - iteration_needed: boolean, whether another revision iteration is needed
+
+    ===== FOCUS GROUP OBJECTIVES =====
+    {objectives}
+
+    ===== FOCUS GROUP TRANSCRIPTS =====
+    {transcripts}""",
+        llm_config={**llm_config, "temperature": temperature},
+    )
+
+def _finish_worker_setup(worker: ConversableAgent) -> ConversableAgent:
+    """Attach the batch client and reply cache to a fan-out worker agent as configured"""
+    if USE_BATCH_API:
+        worker.register_model_client(model_client_cls=BatchOpenAIClient)
+    if ENABLE_REPLY_CACHE:
+        enable_reply_cache(worker)
+    return worker
+
+def _run_one_review(reviewer: ConversableAgent, draft: AnalysisDraft) -> FeedbackCollection:
+    """Ask one reviewer variant for feedback on the current draft and parse its JSON reply"""
+    reply = reviewer.generate_reply(
+        messages=[{
+            "role": "user",
+            "content": f"Please review the following analysis draft:\n\n"
+                       f"Title: {draft.title}\n\n{draft.content}",
+        }]
+    )
+    content = reply.get("content") if isinstance(reply, dict) else reply
+    # Tolerate models that wrap the JSON in a code fence despite instructions
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`")
+        content = content[content.index("{"):content.rindex("}") + 1]
+    return FeedbackCollection.model_validate(_json_loads(content))
+
+def run_parallel_reviews(context_variables: dict[str, Any]) -> SwarmResult:
+    """
+    Fan the current draft out to several reviewer variants in parallel.
+
+    Takes the first reviewer that fully approves the draft (no iteration requested and no
+    major/critical items) and cancels the rest; if every reviewer wants changes, aggregates
+    their feedback items.
+    """
+    max_reviewers = context_variables.get("max_parallel_reviewers", 2)
+    transcripts = get_document(context_variables.get("fg_transcripts_key", ""))
+    objectives = get_document(context_variables.get("fg_objectives_key", ""))
+    draft = context_variables.get("analysis_draft")
+    if isinstance(draft, dict):  # Tolerate dict-shaped drafts from older context state
+        draft = AnalysisDraft(**draft)
+
+    reviewers = [
+        _finish_worker_setup(_make_reviewer_variant(name, temperature, stance, transcripts, objectives))
+        for name, temperature, stance in _REVIEWER_STANCES[:max_reviewers]
+    ]
+
+    reviews: list[FeedbackCollection] = []
+    with ThreadPoolExecutor(max_workers=len(reviewers)) as executor:
+        reviewer_names = {
+            executor.submit(_run_one_review, reviewer, draft): reviewer.name
+            for reviewer in reviewers
+        }
+        pending = set(reviewer_names)
+        approved = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    review = future.result()
+                except Exception as exc:
+                    # A malformed reviewer reply shouldn't sink the whole stage,
+                    # but a silently shrinking panel must be visible
+                    sys.stderr.write(f"ERROR: reviewer {reviewer_names[future]} failed: {exc}\n")
+                    continue
+                reviews.append(review)
+                # Early termination: first full approval wins, drop the remaining
+                # reviewers. Must agree with _apply_review_outcome's routing, or a
+                # review headed for revision would cut the panel short for nothing
+                if not _needs_revision(review):
+                    approved = review
+            if approved is not None:
+                for future in pending:
+                    future.cancel()
+                break
+
+    if approved is not None:
+        feedback = approved
+    elif reviews:
+        # All reviewers want changes: merge their feedback for the revision agent
+        feedback = FeedbackCollection(
+            items=[item for review in reviews for item in review.items],
+            overall_assessment="\n".join(review.overall_assessment for review in reviews),
+            priority_issues=[issue for review in reviews for issue in review.priority_issues],
+            iteration_needed=True,
+        )
+    else:
+        # No reviewer returned parseable feedback: don't fabricate an approval for
+        # an unreviewed draft — record the error and fail over to the single
+        # review_agent path (the stage stays at REVIEW)
+        context_variables["has_error"] = True
+        context_variables["error_message"] = "No parallel reviewer returned parseable feedback"
+        context_variables["error_stage"] = DocumentStage.REVIEW.name
+        return SwarmResult(
+            values="Parallel review failed. Falling back to the single review agent.",
+            agent=review_agent,
+            context_variables=context_variables,
+        )
+
+    outcome = _apply_review_outcome(context_variables, feedback)
+
+    return SwarmResult(
+        values=f"Collected {len(reviews)} parallel review(s). {outcome}",
+        context_variables=context_variables,
+    )
+
+# Analysis Revision Stage
+class RevisedAnalysis(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    title: str = Field(..., description="Analysis title")
+    content: str = Field(..., description="Full text content after revision")
+    changes_made: Optional[list[str]] = Field(..., description="List of changes made based on feedback")
+
+def submit_revised_analysis(
+    title: Annotated[str, "Analysis title"],
+    content: Annotated[str, "Full text content after revision"],
+    changes_made: Annotated[Optional[list[str]], "List of changes made based on feedback"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit the revised document, which may lead to another feedback loop or finalization
+    """
+    revised = RevisedAnalysis(
+        title=title,
+        content=content,
+        changes_made=changes_made
+    )
+    context_variables["revised_analysis"] = revised
+    context_variables["revision_completed"] = True
+
+    # Check if we need another iteration or if we're done
+    if context_variables["iteration_needed"] and context_variables["current_iteration"] < context_variables["max_iterations"]:
+        context_variables["current_iteration"] += 1
+        context_variables["current_stage"] = DocumentStage.REVIEW.value
+
+        # Update the analysis draft with the revisions for the next review
+        context_variables["analysis_draft"] = AnalysisDraft(
+            title=revised.title,
+            content=revised.content
+        )
+
+        return SwarmResult(
+            values=f"Analysis revised. Starting iteration {context_variables['current_iteration']} with another review.",
+            context_variables=context_variables,
+        )
+    else:
+        # We're done with revisions, move to final stage. The superseded draft is
+        # dead weight from here on, so evict it from the per-handoff context copies
+        context_variables.pop("analysis_draft", None)
+        context_variables["current_stage"] = DocumentStage.FINAL.value # Drives OnContextCondition to the next agent
+
+        return SwarmResult(
+            values="Revisions complete. Moving to document finalization.",
+            context_variables=context_variables,
+        )
+
+    
+# Analysis Finalization Stage
+class FinalAnalysis(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    title: str = Field(..., description="Final analysis title")
+    content: str = Field(..., description="Full text content of the final analysis")
+
+def finalize_analysis(
+    title: Annotated[str, "Final analysis title"],
+    content: Annotated[str, "Full text content of the final analysis"],
+    context_variables: dict[str, Any]
+) -> SwarmResult:
+    """
+    Submit the final analysis and complete the feedback loop
+    """
+    final = FinalAnalysis(
+        title=title,
+        content=content
+    )
+    context_variables["final_analysis"] = final
+    context_variables["iteration_needed"] = False
+
+    # The intermediates have served their purpose; drop them so only the final
+    # analysis and the bookkeeping flags ride through the remaining handoffs
+    for key in ("focus_group_transcripts", "focus_group_objectives",
+                "analysis_draft", "feedback_collection", "revised_analysis"):
+        context_variables.pop(key, None)
+
+    # Write the report directly instead of handing off to another LLM agent to
+    # re-emit the same content token by token
+    filepath = _dispatch_report_write(
+        f"# {final.title}\n\n{final.content}",
+        f"{_slugify(final.title)}.md"
+    )
+    context_variables["report_path"] = filepath
+
+    return SwarmResult(
+        values=f"Analysis finalized and report write to {filepath} dispatched. Feedback loop complete.",
+        context_variables=context_variables,
+    )
+
+# Write Report to File
+# Single-thread executor so the disk write overlaps with handing control back
+# to the user. Its thread is non-daemon, so a pending write still completes
+# before the interpreter exits.
+_report_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report_writer")
+
+def _write_report_sync(filepath: str, report: str) -> None:
+    """Write the report bytes in a single syscall, bypassing Python's buffered I/O layer"""
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, report.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def _slugify(title: str) -> str:
+    """Turn an analysis title into a safe markdown filename stem"""
+    return "".join(c if c.isalnum() else "_" for c in title).strip("_") or "report"
+
+def _report_write_done(future) -> None:
+    """Surface background write failures (permissions, disk full) instead of swallowing them"""
+    exception = future.exception()
+    if exception is not None:
+        sys.stderr.write(f"ERROR: failed to write report to disk: {exception}\n")
+
+def _dispatch_report_write(report: str, filename: str) -> str:
+    """Queue a background write of the report into the 'reports' directory"""
+    # Create the 'reports' directory if it doesn't exist (single syscall, no pre-check)
+    reports_dir = os.path.join(os.getcwd(), "reports")
+    os.makedirs(reports_dir, exist_ok=True)
+
+    filepath = os.path.join(reports_dir, filename)
+    # Dispatch the write to the background so REVERT_TO_USER isn't blocked on disk
+    _report_writer.submit(_write_report_sync, filepath, report).add_done_callback(_report_write_done)
+    return filepath
+
+# Agents for the feedback loop
+ingestion_agent = ConversableAgent(
+    name="ingestion_agent",
+    llm_config=llm_config,
+    system_message="You are a helpful assistant that reads the transcripts and objectives files.",
+    functions=[read_data]
+)
+
+drafting_agent = ConversableAgent(
+    name="drafting_agent",
+    system_message="""You are the analysis drafting agent responsible for creating the initial draft.
+
+    Your task is to analyze the focus group transcripts and create a first draft of the analysis. 
+    Review the content in the context of the focus group objectives. 
+
+    Identify key themes, patterns, and insights. Pay particular attention to how the discussion points relate 
+    to the focus group objectives.
+
+    expected_output:
+    A comprehensive analysis draft that includes:
+    1. Identified key themes and patterns from the focus group transcripts
+    2. Insights derived from the discussion, especially those relating to the focus group objectives
+    3. Notable trends or unexpected findings
+    4. Areas of consensus or disagreement among participants
+    5. Potential implications of the findings
+    6. Any gaps in the information or areas that may require further investigation
+    7. Initial recommendations based on the analysis
+
+    You can produce the draft in either of two ways:
+    1. Call the submit_analysis_draft tool with the complete draft text, or
+    2. Call the submit_draft_outline tool with just the ordered section titles — each section
+       is then written out in parallel and assembled into the draft for you (faster for
+       long analyses).
+
+    Either tool will move on to the review stage.""",
+    llm_config=llm_config,
+    functions=[submit_analysis_draft, submit_draft_outline]
+)
+
+draft_review_agent = ConversableAgent(
+    name="draft_review_agent",
+    system_message="""You are the draft-and-review agent responsible for producing the initial
+    draft AND critiquing it in a single pass. First produce the draft, then critique it.
+
+    STEP 1 - DRAFT: Analyze the focus group transcripts in the context of the focus group
+    objectives. Identify key themes, patterns, and insights. The draft must include:
+    1. Identified key themes and patterns from the focus group transcripts
+    2. Insights derived from the discussion, especially those relating to the focus group objectives
+    3. Notable trends or unexpected findings
+    4. Areas of consensus or disagreement among participants
+    5. Potential implications of the findings
+    6. Any gaps in the information or areas that may require further investigation
+    7. Initial recommendations based on the analysis
+
+    STEP 2 - REVIEW: Critically evaluate the draft you just produced. Compare it to the focus
+    group objectives to ensure alignment and thoroughness. For each feedback item provide the
+    detailed feedback, a severity ('minor', 'moderate', 'major', or 'critical'), and a clear
+    recommendation. Also provide an overall assessment, a list of priority issues, and whether
+    another iteration is needed.
+
+    You must call the submit_draft_and_review tool with both the draft and the feedback; that
+    will move on to the revision stage.""",
+    llm_config=llm_config,
+    functions=[submit_draft_and_review]
+)
+
+review_agent = ConversableAgent(
+    name="review_agent",
+    system_message="""You are the analysis review agent responsible for critical evaluation.
+
+    Your task is to carefully review the current analysis draft and provide constructive feedback.
+    Compare the analysis to the focus group objectives to ensure alignment and thoroughness. Assess the quality, clarity, and depth of 
+    insights provided. Identify any gaps, inconsistencies, or areas where the analysis could be improved.
+    
+    For the feedback you MUST provide the following:
+    1. items: list of feedback items (seen next section for the collection of feedback items)
+    2. overall_assessment: Overall assessment of the analysis
+    3. priority_issues: List of priority issues to address
+    4. iteration_needed: Whether another iteration is needed (True or False)
+
+    For each item within feedback, you MUST provide the following:
+    1. feedback: Detailed feedback explaining the issue
+    2. severity: Rate as 'minor', 'moderate', 'major', or 'critical'
+    3. recommendation: A clear, specific action to address the feedback
+
+    Provide specific feedback with examples and clear recommendations for improvement.
+    For each feedback item, rate its severity.
+
+    If this is a subsequent review iteration, also evaluate how well previous feedback was addressed.
+
+    Use the submit_feedback tool when your review is complete, indicating whether another iteration is needed.
+    """,
+    llm_config=llm_config,
+    functions=[submit_feedback]
+)
+
+review_coordinator_agent = ConversableAgent(
+    name="review_coordinator_agent",
+    system_message="""You are the review coordinator agent responsible for gathering feedback.
+
+    Your task is to collect reviews of the current analysis draft from several reviewers at once.
+
+    Call the run_parallel_reviews tool to fan the draft out to the reviewer panel. The tool
+    handles aggregating their feedback and moving to the revision stage.""",
+    llm_config=llm_config,
+    functions=[run_parallel_reviews]
+)
+
+revision_agent = ConversableAgent(
+    name="revision_agent",
+    system_message="""You are the analysis revision agent responsible for implementing feedback.
+
+    Your task is to revise the analysis based on the feedback provided:
+    - Address each feedback item in priority order
+    - Make specific improvements to the content, structure, and clarity
+    - Ensure the revised analysis still aligns with the original objectives
+    - Track and document the changes you make
+
+    Focus on substantive improvements that address the feedback while preserving the analysis' strengths.
+
+    Use the submit_revised_analysis tool when your revisions are complete. The analysis may go through
+    multiple revision cycles depending on the feedback.""",
+    llm_config=llm_config,
+    functions=[submit_revised_analysis]
+)
+
+finalization_agent = ConversableAgent(
+    name="finalization_agent",
+    system_message="""You are the finalization agent responsible for completing the process.
+
+    Your task is to put the finishing touches on the analysis:
+    - Review the analysis's revision history
+    - Make any final minor adjustments for clarity and polish
+    - Ensure the analysis fully satisfies the original objectives
+    - Prepare the final report for delivery with proper formatting
+
+    Create a summary of the analysis's revision journey highlighting how it evolved through the process.
+
+    Use the finalize_analysis tool when the analysis is complete and ready for delivery. The tool
+    saves the final report to the 'reports' directory automatically.""",
+    llm_config=llm_config,
+    functions=[finalize_analysis]
+)
+
+# Append the focus group transcripts and objectives to the analysis agents'
+# system messages once, after they have been read from disk. Keeping this block
+# identical across agents and iterations maximizes prompt-cache prefix hits.
+_shared_context_appended = False
+
+def _append_shared_context_to_agents(transcripts: str, objectives: str) -> None:
+    """Add the transcripts and objectives as a fixed suffix to each agent's system message"""
+    global _shared_context_appended
+    if _shared_context_appended:
+        return
+
+    shared_block = f"""
+
+    ===== FOCUS GROUP OBJECTIVES =====
+    {objectives}
+
+    ===== FOCUS GROUP TRANSCRIPTS =====
+    {transcripts}"""
+
+    for agent in (drafting_agent, draft_review_agent, review_agent, revision_agent, finalization_agent):
+        agent.update_system_message(agent.system_message + shared_block)
+
+    _shared_context_appended = True
+
+
+# User agent for interaction
+user = UserProxyAgent(
+    name="user",
+    code_execution_config=False
+)
+
+# Handoff conditions with pre-compiled callables
+class CompiledContextExpression(ContextExpression):
+    """ContextExpression that evaluates a pre-compiled callable instead of
+    re-interpreting the expression string on every routing decision"""
+
+    def __init__(self, expression: str, compiled_fn):
+        super().__init__(expression)
+        self._compiled_fn = compiled_fn
+
+    def evaluate(self, context_variables: dict[str, Any]) -> bool:
+        return self._compiled_fn(context_variables)
+
+
+# Register handoffs for the feedback loop
+# Ingestion agent starts the loop: on the first iteration the combined
+# draft-and-review agent does both stages in one LLM round-trip
+register_hand_off(
+    agent=ingestion_agent,
+    hand_to=[
+        OnContextCondition(
+            target=draft_review_agent,
+            condition=CompiledContextExpression(
+                "${loop_started} == True and ${current_stage} == 0 and ${current_iteration} == 1 and ${use_combined_draft_review} == True",
+                lambda ctx: ctx["loop_started"] and ctx["current_stage"] == DocumentStage.ANALYSIS and ctx["current_iteration"] == 1 and ctx["use_combined_draft_review"]
+            )
+        ),
+        OnContextCondition(
+            target=drafting_agent,
+            condition=CompiledContextExpression(
+                "${loop_started} == True and ${current_stage} == 0",
+                lambda ctx: ctx["loop_started"] and ctx["current_stage"] == DocumentStage.ANALYSIS
+            )
+        )
+    ]
+)
+
+# Draft-and-review agent passes to Revision agent, or straight to Finalization
+# when the built-in review approved the draft
+register_hand_off(
+    agent=draft_review_agent,
+    hand_to=[
+        OnContextCondition(
+            target=revision_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 2",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVISION
+            )
+        ),
+        OnContextCondition(
+            target=finalization_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 3",
+                lambda ctx: ctx["current_stage"] == DocumentStage.FINAL
+            )
+        )
+    ]
+)
+
+# Drafting agent passes to the Review coordinator (parallel panel) or the single Review agent
+register_hand_off(
+    agent=drafting_agent,
+    hand_to=[
+        OnContextCondition(
+            target=review_coordinator_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 1 and ${max_parallel_reviewers} > 1",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVIEW and ctx["max_parallel_reviewers"] > 1
+            )
+        ),
+        OnContextCondition(
+            target=review_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 1",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVIEW
+            )
+        )
+    ]
+)
+
+# Review agent passes to Revision agent, or straight to Finalization on approval
+register_hand_off(
+    agent=review_agent,
+    hand_to=[
+        OnContextCondition(
+            target=revision_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 2",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVISION
+            )
+        ),
+        OnContextCondition(
+            target=finalization_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 3",
+                lambda ctx: ctx["current_stage"] == DocumentStage.FINAL
+            )
+        )
+    ]
+)
+
+# Review coordinator passes to Revision agent, or straight to Finalization on approval
+register_hand_off(
+    agent=review_coordinator_agent,
+    hand_to=[
+        OnContextCondition(
+            target=revision_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 2",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVISION
+            )
+        ),
+        OnContextCondition(
+            target=finalization_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 3",
+                lambda ctx: ctx["current_stage"] == DocumentStage.FINAL
+            )
+        )
+    ]
+)
+
+# Revision agent passes back to a Review stage or to Finalization agent
+register_hand_off(
+    agent=revision_agent,
+    hand_to=[
+        OnContextCondition(
+            target=finalization_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 3",
+                lambda ctx: ctx["current_stage"] == DocumentStage.FINAL
+            )
+        ),
+        OnContextCondition(
+            target=review_coordinator_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 1 and ${max_parallel_reviewers} > 1",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVIEW and ctx["max_parallel_reviewers"] > 1
+            )
+        ),
+        OnContextCondition(
+            target=review_agent,
+            condition=CompiledContextExpression(
+                "${current_stage} == 1",
+                lambda ctx: ctx["current_stage"] == DocumentStage.REVIEW
+            )
+        )
+    ]
+)
+
+# Finalization agent completes the loop and returns to user (the report itself
+# is written to disk inside finalize_analysis)
+register_hand_off(
+    agent=finalization_agent,
+    hand_to=[
+        AfterWork(AfterWorkOption.REVERT_TO_USER)
+    ]
+)
+
+
+# All agents participating in the swarm, plus an O(1) name -> agent map so
+# lookups by name are a dict hit rather than a scan of the agents list
+feedback_loop_agents = [
+    ingestion_agent,
+    draft_review_agent,
+    drafting_agent,
+    review_agent,
+    review_coordinator_agent,
+    revision_agent,
+    finalization_agent
+]
+agent_map = {agent.name: agent for agent in feedback_loop_agents + [user]}
+
+# Attach the batch-backed client where requested; agents otherwise keep the
+# regular synchronous OpenAI client from llm_config
+if USE_BATCH_API:
+    for _agent in feedback_loop_agents:
+        _agent.register_model_client(model_client_cls=BatchOpenAIClient)
+
+# Serve identical prompts from the on-disk cache during development replays
+if ENABLE_REPLY_CACHE:
+    for _agent in (draft_review_agent, drafting_agent, review_agent, revision_agent):
+        enable_reply_cache(_agent)
+
+
+# Run the feedback loop
+def run_feedback_loop_pattern():
+    """Run the feedback loop pattern for analysis creation with iterative refinement"""
+    print("Initiating Feedback Loop Pattern for Analysis Creation...")
+
+    chat_result, final_context, last_agent = initiate_swarm_chat(
+        initial_agent=ingestion_agent,
+        agents=feedback_loop_agents,
+        messages=f"Please read the focus group transcripts and focus group objectives",
+        context_variables=shared_context,
+        user_agent=user,
+        max_rounds=30,
+        after_work=AfterWork(AfterWorkOption.REVERT_TO_USER)
+    )
+
+    final_analysis = final_context.get("final_analysis")
+    if isinstance(final_analysis, BaseModel):
+        # One dump at the edge for display; the loop itself passes instances around
+        final_analysis = final_analysis.model_dump()
+
+    # Accumulate the whole report and emit it with a single write, rather than
+    # paying one line-buffered stdout flush per print call
+    out: list[str] = []
+    if final_analysis:
+        out.append("Analysis completed successfully!")
+        out.append("\n===== ANALYSIS SUMMARY =====\n")
+        out.append(f"Title: {final_analysis.get('title')}")
+        out.append(f"Word Count: {final_analysis.get('word_count')}")
+        out.append(f"Iterations: {final_context.get('current_iteration')}")
+
+        out.append("\n===== FEEDBACK LOOP PROGRESSION =====\n")
+        # Show the progression through iterations
+        for i in range(1, final_context.get('current_iteration') + 1):
+            out.append(f"Iteration {i}:")
+            if i == 1:
+                out.append(f"  Analysis: {'✅ Completed' if 'final_analysis' in final_context else '❌ Not reached'}")
+            out.append(f"  Review: {'✅ Completed' if final_context.get('review_completed') else '❌ Not reached'}")
+            out.append(f"  Revision: {'✅ Completed' if final_context.get('revision_completed') else '❌ Not reached'}")
+
+        out.append(f"Finalization: {'✅ Completed' if 'final_analysis' in final_context else '❌ Not reached'}")
+
+        out.append("\n===== REVISION HISTORY =====\n")
+        out.extend(f"- {history_item}" for history_item in final_analysis.get('revision_history', []))
+
+        out.append("\n===== FINAL ANALYSIS =====\n")
+        out.append(final_analysis.get('content', ''))
+
+        out.append("\n\n===== SPEAKER ORDER =====\n")
+        # Dict-membership check (excludes the internal tool executor) instead of a name scan
+        out.extend(
+            message['name'] for message in chat_result.chat_history
+            if message.get("name") in agent_map
+        )
+    else:
+        out.append("Document creation did not complete successfully.")
+        if final_context.get("has_error"):
+            out.append(f"Error during {final_context.get('error_stage')} stage: {final_context.get('error_message')}")
+
+    sys.stdout.write('\n'.join(out) + '\n')
+
+if __name__ == "__main__":
     run_feedback_loop_pattern()
\ No newline at end of file